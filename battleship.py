@@ -10,9 +10,8 @@ Contains core data structures and logic for Battleship, including:
 
 import random
 import threading
-import select
 import time
-from protocol import safe_send, safe_recv, PACKET_TYPES
+from protocol import safe_send, safe_broadcast, safe_recv, connection_closed, PACKET_TYPES
 import state
 
 
@@ -279,8 +278,7 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
     # Ensure the reconnect flag is set at the beginning of every new game so
     # timer logic inside handle_input_during_turn() starts with the correct
     # assumption that both players are present.
-    global server_state
-    state.server_state = state.ServerState.SETUP
+    state.set_state(state.ServerState.SETUP)
     player_reconnecting.set()
 
     def send_to_player(player_idx, message):
@@ -305,23 +303,36 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
             return False
 
     def send_to_spectators(message):
-        """Send a message to all spectators."""
-        success = True
+        """Send a message to all spectators, building the packet once per attempt."""
+        spectators = {}
         for i in range(MAX_PLAYERS, len(all_connections)):
             if all_connections[i] is not None:
-                try:
-                    conn, _, rfile, wfile, _ = all_connections[i]
-                    for attempt in range(3):
-                        if safe_send(wfile, rfile, message, PACKET_TYPES['GAME_STATE']):
-                            break
-                        time.sleep(0.1)  # Small delay between retries
-                    else:
-                        print(f"[WARNING] Failed to send critical message to Spectator {i - MAX_PLAYERS + 1} after 3 attempts")
-                        success = False
-                except Exception as e:
-                    print(f"[ERROR] Failed to send message to Spectator {i - MAX_PLAYERS + 1}: {e}")
-                    success = False
-        return success
+                conn, _, rfile, wfile, _ = all_connections[i]
+                spectators[(wfile, rfile)] = i - MAX_PLAYERS + 1
+        pending = list(spectators)
+        try:
+            for attempt in range(3):
+                pending = safe_broadcast(pending, message, PACKET_TYPES['GAME_STATE'])
+                if not pending:
+                    return True
+                time.sleep(0.1)  # Small delay between retries
+        except Exception as e:
+            print(f"[ERROR] Failed to send message to spectators: {e}")
+            return False
+        for peer in pending:
+            print(f"[WARNING] Failed to send critical message to Spectator {spectators[peer]} after 3 attempts")
+        return False
+
+    def format_board(board, show_hidden=False):
+        """Build the GRID text for a board."""
+        board_msg = "GRID\n+"  # Start with GRID marker
+        board_msg += "  " + " ".join(str(i + 1) for i in range(board.size)) + '\n'
+        for row in range(board.size):
+            row_label = chr(65 + row)  # A, B, C, ...
+            row_str = " ".join(board.hidden_grid[row] if show_hidden else board.display_grid[row])
+            board_msg += f"{row_label:2} {row_str}\n"
+        board_msg += '\n'  # Empty line to end grid
+        return board_msg
 
     def send_board_to_player(player_idx, board, show_hidden=False):
         """Send a board representation to a specific player."""
@@ -329,41 +340,20 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
             if all_connections[player_idx] is None:
                 print(f"[DEBUG] Cannot send board to player {player_idx} - connection is None")
                 return False
-            # Build the entire board message as a single string
-            board_msg = "GRID\n+"  # Start with GRID marker
-            board_msg += "  " + " ".join(str(i + 1) for i in range(board.size)) + '\n'
-            for row in range(board.size):
-                row_label = chr(65 + row)  # A, B, C, ...
-                row_str = " ".join(board.hidden_grid[row] if show_hidden else board.display_grid[row])
-                board_msg += f"{row_label:2} {row_str}\n"
-            board_msg += '\n'  # Empty line to end grid
-            
             # Send the entire board as a single message
+            board_msg = format_board(board, show_hidden)
             safe_send(all_connections[player_idx][3], all_connections[player_idx][2], board_msg, PACKET_TYPES['BOARD_UPDATE'])
             time.sleep(0.1)  # Add a small delay to prevent message duplication
             return True
         except Exception as e:
             print(f"Error sending board to player {player_idx}: {e}")
 
-    def send_board_to_spectators(board):
-        """Send a board representation to all spectators."""
-        try:
-            # Build the entire board message as a single string
-            board_msg = "GRID\n+"  # Start with GRID marker
-            board_msg += "  " + " ".join(str(i + 1) for i in range(board.size)) + '\n'
-            for row in range(board.size):
-                row_label = chr(65 + row)  # A, B, C, ...
-                row_str = " ".join(board.display_grid[row])
-                board_msg += f"{row_label:2} {row_str}\n"
-            board_msg += '\n'  # Empty line to end grid
-            
-            # Send the entire board as a single message to each spectator
-            for i in range(MAX_PLAYERS, len(all_connections)):
-                if all_connections[i] is not None:
-                    safe_send(all_connections[i][3], all_connections[i][2], board_msg, PACKET_TYPES['BOARD_UPDATE'])
-                    time.sleep(0.1)  # Add a small delay to prevent message duplication
-        except Exception as e:
-            print(f"Error sending board to spectators: {e}")
+    def send_boards_to_spectators(header=""):
+        """Send both boards to all spectators as one message, after an optional header."""
+        send_to_spectators(header + "\n".join((
+            "\nPlayer 1's Board:\n", format_board(boards[0]),
+            "\nPlayer 2's Board:\n", format_board(boards[1]),
+        )))
 
     def recv_from_player(player_idx, timeout=INACTIVITY_TIMEOUT):
         """Receive a message from a specific player."""
@@ -538,14 +528,10 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
                                 return
                             
                             opponent_idx = 1 - player_idx
-                            try:
-                                if all_connections[opponent_idx] is not None:
-                                    readable, _, _ = select.select([all_connections[opponent_idx][2].fileno()], [], [], 0)
-                                    if readable:
-                                        opponent_line = all_connections[opponent_idx][2].readline()
-                                        if not opponent_line:  # Opponent disconnected
-                                            raise ConnectionResetError()
-                            except (ConnectionResetError, OSError):
+                            # Peek rather than read: the opponent's stream carries framed
+                            # packets that their own setup thread must receive intact
+                            opponent = all_connections[opponent_idx]
+                            if opponent is not None and connection_closed(opponent[0]):
                                 if not send_to_player(player_idx, "[ALERT] Your opponent has lost connection. \n\n"):
                                     setup_success[player_idx] = False
                                     player_ready_events[player_idx].set()
@@ -654,7 +640,7 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
     send_to_spectators("Game is starting! You will receive updates as the game progresses.")
     
     current_player = 0
-    state.server_state = state.ServerState.IN_GAME
+    state.set_state(state.ServerState.IN_GAME)
     RECONNECT_TIMEOUT = 60
     REMINDER_INTERVAL = 15
 
@@ -675,8 +661,8 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
             if remaining <= 0:
                 return False  # timed-out
 
-            # Wait until either player_reconnecting is set or reminder interval
-            if player_reconnecting.is_set():
+            # Block until player_reconnecting is set, the next reminder is due or time runs out
+            if player_reconnecting.wait(min(remaining, max(0, next_reminder - time.time()))):
                 # Player came back
                 send_to_spectators(f"[INFO] Player {disconnected_idx + 1} has reconnected — game resumes.")
                 send_to_player(1 - disconnected_idx, f"[INFO] Player {disconnected_idx + 1} reconnected. Your opponent is back!")
@@ -684,12 +670,10 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
 
             # Not yet — time for another reminder?
             if time.time() >= next_reminder:
+                remaining = RECONNECT_TIMEOUT - (time.time() - start_time)
                 send_to_spectators(f"[INFO] Still waiting for Player {disconnected_idx + 1} to reconnect… ({int(remaining)} s left)")
                 send_to_player(1 - disconnected_idx, f"[INFO] Still waiting for Player {disconnected_idx + 1} to reconnect… ({int(remaining)} s left)")
                 next_reminder += REMINDER_INTERVAL
-
-            # Small sleep to avoid busy loop if REMINDER_INTERVAL is large.
-            time.sleep(0.5)
     
     while True:
         # Ensure both players are connected before starting the turn.
@@ -719,14 +703,11 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
             return
 
         try:
-            # Show boards to current player
-            if not send_to_player(current_player, "Your board:"):
-                return
-            if not send_board_to_player(current_player, boards[current_player], True):
-                return
-            if not send_to_player(current_player, "Opponent's board:"):
-                return
-            if not send_board_to_player(current_player, boards[1 - current_player], False):
+            # Show both boards to current player in one message
+            if not send_to_player(current_player, "\n".join((
+                "Your board:", format_board(boards[current_player], True),
+                "Opponent's board:", format_board(boards[1 - current_player]),
+            ))):
                 return
 
             # Send turn notification
@@ -734,12 +715,8 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
                 return
             if not send_to_player(1 - current_player, f"\nWaiting for Player {current_player + 1}'s move..."):
                 return
-            send_to_spectators(f"\nPlayer {current_player + 1}'s turn to fire...")
-            send_to_spectators(f"\nPlayer Boards:\n")
-            send_to_spectators(f"\nPlayer 1's Board:\n")
-            send_board_to_spectators(boards[0])
-            send_to_spectators(f"\nPlayer 2's Board:\n")
-            send_board_to_spectators(boards[1])
+            # One message per update; joined with newlines it prints the same as separate sends
+            send_boards_to_spectators(f"\nPlayer {current_player + 1}'s turn to fire...\n\nPlayer Boards:\n\n")
 
             # Get firing coordinate from current player
             while True:
@@ -786,10 +763,7 @@ def run_multiplayer_game_online(player_reconnecting, all_connections):
                         continue
 
                     # Update spectator boards after each move
-                    send_to_spectators(f"\nPlayer 1's Board:\n")
-                    send_board_to_spectators(boards[0])
-                    send_to_spectators(f"\nPlayer 2's Board:\n")
-                    send_board_to_spectators(boards[1])
+                    send_boards_to_spectators()
 
                 except ValueError as e:
                     send_to_player(current_player, f"Invalid input: {e}")
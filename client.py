@@ -7,7 +7,7 @@ import threading
 import sys
 import time
 import select
-from protocol import safe_send, safe_recv, PACKET_TYPES
+from protocol import safe_send, safe_recv, open_socket_files, PACKET_TYPES
 
 HOST = '127.0.0.1'
 PORT = 5000
@@ -102,8 +102,7 @@ def main():
                         sys.exit(1)
             
             # Use binary mode for file objects
-            rfile = s.makefile('rb')
-            wfile = s.makefile('wb')
+            rfile, wfile = open_socket_files(s)
             
             # Start a thread for receiving messages
             receive_thread = threading.Thread(target=receive_messages, args=(rfile, wfile))
@@ -1,5 +1,7 @@
 import struct
+import zlib
 import select
+import socket
 import threading
 import logging
 from datetime import datetime
@@ -25,6 +27,8 @@ logger.propagate = False
 INACTIVITY_TIMEOUT = 30  # Default timeout, can be overridden
 MAX_RETRIES = 2  # Reduced from 3 to 2
 RETRY_DELAY = 0.05  # Reduced from 0.1 to 0.05
+HEADER = struct.Struct('!BBHH')  # type(1B) seq(1B) checksum(2B) payload_len(2B), compiled once
+SOCKET_FILE_BUFFER = 512  # Write buffer size for socket files; packets are far smaller than the 8 KiB default
 
 # Packet types
 PACKET_TYPES = {
@@ -38,6 +42,12 @@ PACKET_TYPES = {
     'GAME_STATE': 8  # New packet type for critical game state messages
 }
 
+# Packet types compared on every send and receive, bound once instead of looked up per packet
+_ACK = PACKET_TYPES['ACK']
+_PLAYER_MOVE = PACKET_TYPES['PLAYER_MOVE']
+_GAME_STATE = PACKET_TYPES['GAME_STATE']
+_RETRANSMISSION_REQUEST = PACKET_TYPES['RETRANSMISSION_REQUEST']
+
 # Sequence number generator
 _sequence_num = 0
 _sequence_lock = threading.Lock()
@@ -118,6 +128,8 @@ def next_sequence_num():
         return _sequence_num
 
 class Packet:
+    _packed = None  # Wire bytes, built on the first pack()
+
     def __init__(self, packet_type, sequence_num, payload):
         self.packet_type = packet_type
         self.sequence_num = sequence_num
@@ -127,62 +139,77 @@ class Packet:
         self.timestamp = datetime.now()
     
     def _calculate_checksum(self):
-        """Calculate a simple sum-based checksum."""
+        """Calculate a CRC-32 based checksum, truncated to 2 bytes."""
+        return self._checksum(self.packet_type, self.sequence_num, self.encrypted_payload)
+
+    @staticmethod
+    def _checksum(packet_type, sequence_num, encrypted_payload):
+        """Checksum of a packet's header fields and encrypted payload (any bytes-like object)."""
         # Format: [type(1B)][seq(1B)][payload_len(2B)][payload]
-        header = struct.pack('!BBHH',
-            self.packet_type,
-            self.sequence_num,
+        header = HEADER.pack(
+            packet_type,
+            sequence_num,
             0,  # placeholder for checksum during calculation
-            len(self.encrypted_payload)
+            len(encrypted_payload)
         )
         
-        # Calculate sum of all bytes
-        total = sum(header + self.encrypted_payload)
-        # Take modulo 65536 to keep checksum to 2 bytes
-        return total % 65536
+        # CRC the header, then continue over the payload without concatenating them.
+        # zlib's C implementation replaces the per-byte Python sum and also catches
+        # reordered bytes, which a plain sum cannot.
+        crc = zlib.crc32(header)
+        crc = zlib.crc32(encrypted_payload, crc)
+        # Keep the low 16 bits to fit the 2-byte checksum field
+        return crc & 0xFFFF
     
     def pack(self):
-        # Pack the packet into a binary format
+        # Pack the packet into a binary format once; retransmissions reuse the same bytes
         # Format: [type(1B)][seq(1B)][checksum(2B)][payload_len(2B)][payload]
-        header = struct.pack('!BBHH',
-            self.packet_type,
-            self.sequence_num,
-            self.checksum,
-            len(self.encrypted_payload)
-        )
-        return header + self.encrypted_payload
+        if self._packed is None:
+            header = HEADER.pack(
+                self.packet_type,
+                self.sequence_num,
+                self.checksum,
+                len(self.encrypted_payload)
+            )
+            self._packed = header + self.encrypted_payload
+        return self._packed
     
     @classmethod
     def unpack(cls, data):
         try:
             # Verify minimum packet length
-            if len(data) < 6:  # 6 bytes for header (type, seq, checksum, payload_len)
+            if len(data) < HEADER.size:  # 6 bytes for header (type, seq, checksum, payload_len)
                 logger.warning("Packet too short for valid checksum verification")
                 return None
                 
             # Unpack header
-            header = struct.unpack('!BBHH', data[:6])
+            header = HEADER.unpack_from(data)
             packet_type, sequence_num, received_checksum, payload_len = header
             
             # Verify payload length
-            if len(data) < 6 + payload_len:
-                logger.warning(f"Packet payload length mismatch. Expected {payload_len} bytes but got {len(data) - 6}")
+            if len(data) < HEADER.size + payload_len:
+                logger.warning(f"Packet payload length mismatch. Expected {payload_len} bytes but got {len(data) - HEADER.size}")
                 return None
             
-            # Extract payload
-            encrypted_payload = data[6:6+payload_len]
-            payload = decrypt_payload(encrypted_payload, sequence_num)
-
-            
-            # Create temporary packet for checksum verification
-            temp_packet = cls(packet_type, sequence_num, payload)
-            
-            # Verify checksum
-            if temp_packet.checksum != received_checksum:
-                logger.warning(f"Checksum mismatch for packet {sequence_num}. Expected {received_checksum}, got {temp_packet.checksum}")
+            # View the payload in place instead of copying it out of data
+            encrypted_payload = memoryview(data)[HEADER.size:HEADER.size + payload_len]
+
+            # Verify checksum over the bytes as received, so corrupted packets are
+            # rejected before decryption and nothing is re-encrypted to check them
+            checksum = cls._checksum(packet_type, sequence_num, encrypted_payload)
+            if checksum != received_checksum:
+                logger.warning(f"Checksum mismatch for packet {sequence_num}. Expected {received_checksum}, got {checksum}")
                 return None
-            
-            return temp_packet
+
+            # Build the packet from the verified fields without going through __init__
+            packet = cls.__new__(cls)
+            packet.packet_type = packet_type
+            packet.sequence_num = sequence_num
+            packet.payload = decrypt_payload(encrypted_payload, sequence_num)
+            packet.encrypted_payload = bytes(encrypted_payload)
+            packet.checksum = checksum
+            packet.timestamp = datetime.now()
+            return packet
         except struct.error as e:
             logger.error(f"Invalid packet format during checksum verification: {str(e)}")
             return None
@@ -190,6 +217,40 @@ class Packet:
             logger.error(f"Error during packet unpacking and checksum verification: {str(e)}")
             return None
 
+def open_socket_files(sock):
+    """Wrap a connected socket in binary (rfile, wfile) file objects.
+    The read side is unbuffered: callers select() on rfile.fileno() before reading,
+    and a read-ahead buffer would hide packets that have already arrived."""
+    return sock.makefile('rb', buffering=0), sock.makefile('wb', buffering=SOCKET_FILE_BUFFER)
+
+def connection_closed(conn):
+    """Return True if the peer has closed conn or the socket has failed.
+    Peeks without blocking and without consuming any data. Uses a zero-timeout
+    select() rather than MSG_DONTWAIT, which Windows doesn't provide."""
+    try:
+        if not select.select([conn], [], [], 0)[0]:
+            return False  # Nothing to read, but still connected
+        return conn.recv(1, socket.MSG_PEEK) == b''
+    except BlockingIOError:
+        return False  # Readiness went away before the peek; still connected
+    except (OSError, ValueError):
+        return True  # Reset, or dropped after unanswered keepalive probes
+
+def read_exact(rfile, size):
+    """Read exactly size bytes from rfile, fewer only if the connection closes."""
+    data = rfile.read(size)
+    if not data or len(data) == size:
+        return data
+    chunks = [data]
+    received = len(data)
+    while received < size:
+        chunk = rfile.read(size - received)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        received += len(chunk)
+    return b"".join(chunks)
+
 def safe_send(wfile, rfile, message, packet_type=PACKET_TYPES['SYSTEM_MESSAGE']):
     """Safely send a message to a client using our custom protocol with retransmission."""
     try:
@@ -204,12 +265,11 @@ def safe_send(wfile, rfile, message, packet_type=PACKET_TYPES['SYSTEM_MESSAGE'])
         packed_data = packet.pack()
         sent_packets[packet.sequence_num] = packet
         # For PLAYER_MOVE packets, we need to ensure we get an ACK before proceeding
-        if packet_type == PACKET_TYPES['PLAYER_MOVE']:
+        if packet_type == _PLAYER_MOVE:
             wfile.write(packed_data)
             wfile.flush()
             # Wait for ACK with a longer timeout for moves
             if wait_for_ack(rfile, wfile, packet.sequence_num, timeout=1.0):
-                time.sleep(0.05)  # Small delay after successful ACK
                 return True
             logger.warning(f"Failed to get ACK for PLAYER_MOVE packet {packet.sequence_num}")
             for seq in list(sent_packets):
@@ -223,7 +283,6 @@ def safe_send(wfile, rfile, message, packet_type=PACKET_TYPES['SYSTEM_MESSAGE'])
             wfile.flush()
             # Wait for ACK with a longer timeout for turn transitions
             if wait_for_ack(rfile, wfile, packet.sequence_num, timeout=1.0):
-                time.sleep(0.1)  # Longer delay for turn transitions
                 return True
             logger.warning(f"Failed to get ACK for turn transition message")
             for seq in list(sent_packets):
@@ -241,7 +300,6 @@ def safe_send(wfile, rfile, message, packet_type=PACKET_TYPES['SYSTEM_MESSAGE'])
 
                 # Wait for ACK with a reasonable timeout
                 if wait_for_ack(rfile, wfile, packet.sequence_num, timeout=0.5):
-                    time.sleep(0.05)  # Small delay after successful ACK
                     for seq in list(sent_packets):
                         if (packet.sequence_num - seq) % 256 > replay_window.window_size:
                             del sent_packets[seq]
@@ -274,6 +332,48 @@ def safe_send(wfile, rfile, message, packet_type=PACKET_TYPES['SYSTEM_MESSAGE'])
                 del sent_packets[seq]
         return False
 
+def safe_broadcast(peers, message, packet_type=PACKET_TYPES['SYSTEM_MESSAGE']):
+    """Send the same message to several peers, building the packet only once.
+    peers is a list of (wfile, rfile) pairs. The packet is written to every peer
+    before any ACK is awaited, so the round trips overlap instead of adding up.
+    Returns the peers that never acknowledged it."""
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+
+    # Encrypt, checksum and frame once; every peer gets the same wire bytes
+    packet = Packet(packet_type, next_sequence_num(), message)
+    packed_data = packet.pack()
+    sent_packets[packet.sequence_num] = packet
+
+    pending = list(peers)
+    attempt = 0
+    while pending and attempt < MAX_RETRIES:
+        if attempt:
+            logger.warning(f"Retransmission attempt {attempt} for packet {packet.sequence_num} to {len(pending)} peer(s) - No ACK received")
+            time.sleep(RETRY_DELAY)
+        attempt += 1
+
+        written, failed = [], []
+        for wfile, rfile in pending:
+            try:
+                wfile.write(packed_data)
+                wfile.flush()
+                written.append((wfile, rfile))
+            except Exception as e:
+                logger.error(f"Error during broadcast attempt {attempt} for packet {packet.sequence_num}: {str(e)}")
+                failed.append((wfile, rfile))
+
+        # ACKs for the peers waited on last have usually arrived by the time we get to them
+        pending = failed + [(wfile, rfile) for wfile, rfile in written
+                            if not wait_for_ack(rfile, wfile, packet.sequence_num, timeout=0.5)]
+
+    if pending:
+        logger.error(f"Failed to receive ACK for packet {packet.sequence_num} from {len(pending)} peer(s) after {MAX_RETRIES} attempts")
+    for seq in list(sent_packets):
+        if (packet.sequence_num - seq) % 256 > replay_window.window_size:
+            del sent_packets[seq]
+    return pending
+
 def safe_recv(rfile, wfile, timeout=INACTIVITY_TIMEOUT):
     """Safely receive a message with sequence validation and retransmission requests."""
     try:
@@ -283,24 +383,24 @@ def safe_recv(rfile, wfile, timeout=INACTIVITY_TIMEOUT):
             return None  # Timeout occurred
             
         # Read header first (6 bytes)
-        header = rfile.read(6)
-        if not header or len(header) < 6:
+        header = read_exact(rfile, HEADER.size)
+        if not header or len(header) < HEADER.size:
             logger.warning("Received incomplete header during packet reception")
             return None
             
         # Unpack header to get payload length
         try:
-            packet_type, sequence_num, received_checksum, payload_len = struct.unpack('!BBHH', header)
+            packet_type, sequence_num, received_checksum, payload_len = HEADER.unpack(header)
         except struct.error as e:
             logger.error(f"Failed to unpack header during packet reception: {str(e)}")
             return None
         
         # For ACK packets, we know they have no payload
-        if packet_type == PACKET_TYPES['ACK']:
+        if packet_type == _ACK:
             return None
             
         # Read payload for non-ACK packets
-        payload = rfile.read(payload_len)
+        payload = read_exact(rfile, payload_len)
         if not payload or len(payload) < payload_len:
             logger.warning(f"Received incomplete payload. Expected {payload_len} bytes but got {len(payload) if payload else 0}")
             return None
@@ -309,7 +409,7 @@ def safe_recv(rfile, wfile, timeout=INACTIVITY_TIMEOUT):
         packet = Packet.unpack(header + payload)
         if packet is None:
             # Only request retransmission for non-ACK packets
-            if packet_type != PACKET_TYPES['ACK']:
+            if packet_type != _ACK:
                 logger.warning("Requesting retransmission due to packet validation failure")
                 request_retransmission(wfile, sequence_num)
             return None
@@ -317,7 +417,7 @@ def safe_recv(rfile, wfile, timeout=INACTIVITY_TIMEOUT):
         # Replay protection
         if is_replay(packet.sequence_num):
             logger.warning(f"Replay attack detected: duplicate or old sequence number {packet.sequence_num}")
-            if packet.packet_type == PACKET_TYPES['RETRANSMISSION_REQUEST']:
+            if packet.packet_type == _RETRANSMISSION_REQUEST:
                 if packet.payload:
                     missing_seq = struct.unpack('!B', packet.payload[:1])[0]
                     if missing_seq in sent_packets:
@@ -331,11 +431,11 @@ def safe_recv(rfile, wfile, timeout=INACTIVITY_TIMEOUT):
                 return None
 
         # Send ACK for all non-ACK packets
-        if packet.packet_type != PACKET_TYPES['ACK']:
+        if packet.packet_type != _ACK:
             send_ack(wfile, packet.sequence_num)
         
         # Don't process ACK packets as messages
-        if packet.packet_type == PACKET_TYPES['ACK']:
+        if packet.packet_type == _ACK:
             return None
             
         return packet.payload.decode('utf-8')
@@ -352,16 +452,16 @@ def wait_for_ack(rfile, wfile, sequence_num, timeout=0.5):
             if readable:
                 # Read and process all available packets
                 while True:
-                    header = rfile.read(6)
+                    header = read_exact(rfile, HEADER.size)
                     if not header:
                         logger.warning(f"No header received while waiting for ACK of packet {sequence_num} - Connection may be closed")
                         return False
                         
                     try:
-                        packet_type, ack_seq, _, payload_len = struct.unpack('!BBHH', header)
+                        packet_type, ack_seq, _, payload_len = HEADER.unpack(header)
                         
                         # For ACK packets, check if it matches our sequence
-                        if packet_type == PACKET_TYPES['ACK']:
+                        if packet_type == _ACK:
                             if (ack_seq % 256) == (sequence_num % 256):
                                 replay_window.mark_acknowledged(sequence_num)
                                 return True
@@ -369,7 +469,7 @@ def wait_for_ack(rfile, wfile, sequence_num, timeout=0.5):
                         
                         # For non-ACK packets, read the payload and process it
                         if payload_len > 0:
-                            payload = rfile.read(payload_len)
+                            payload = read_exact(rfile, payload_len)
                             if not payload:
                                 logger.warning(f"Failed to read payload of {payload_len} bytes - Connection may be closed")
                                 return False
@@ -378,7 +478,7 @@ def wait_for_ack(rfile, wfile, sequence_num, timeout=0.5):
                             send_ack(wfile, ack_seq)
                             
                             # For critical packets like GAME_STATE, we should not wait indefinitely
-                            if packet_type == PACKET_TYPES['GAME_STATE']:
+                            if packet_type == _GAME_STATE:
                                 logger.warning(f"Received critical GAME_STATE packet while waiting for ACK of {sequence_num}")
                                 # If we've waited more than half the timeout, return False to allow retransmission
                                 if time.time() - start_time > timeout / 2:
@@ -386,7 +486,7 @@ def wait_for_ack(rfile, wfile, sequence_num, timeout=0.5):
                                     return False
                             
                             # For PLAYER_MOVE packets, we should be more lenient
-                            if packet_type == PACKET_TYPES['PLAYER_MOVE']:
+                            if packet_type == _PLAYER_MOVE:
                                 logger.warning(f"Received PLAYER_MOVE packet while waiting for ACK of {sequence_num}")
                                 # Continue waiting for our original ACK
                                 continue
@@ -402,11 +502,16 @@ def wait_for_ack(rfile, wfile, sequence_num, timeout=0.5):
     logger.warning(f"Timeout waiting for ACK of packet {sequence_num}")
     return False
 
+_ack_frames = {}  # Wire bytes of the ACK for each sequence number, built on first use
+
 def send_ack(wfile, sequence_num):
     """Send an acknowledgment packet."""
     try:
-        ack_packet = Packet(PACKET_TYPES['ACK'], sequence_num, b'')
-        wfile.write(ack_packet.pack())
+        frame = _ack_frames.get(sequence_num)
+        if frame is None:
+            # An ACK has no payload, so its bytes depend only on the sequence number
+            frame = _ack_frames[sequence_num] = Packet(_ACK, sequence_num, b'').pack()
+        wfile.write(frame)
         wfile.flush()
     except Exception as e:
         logger.error(f"Error sending ACK: {str(e)}")
@@ -416,7 +521,7 @@ def request_retransmission(wfile, missing_seq):
     try:
         # Payload contains the sequence number being requested (1 byte)
         payload = struct.pack('!B', missing_seq)
-        retry_packet = Packet(PACKET_TYPES['RETRANSMISSION_REQUEST'], next_sequence_num(), payload)
+        retry_packet = Packet(_RETRANSMISSION_REQUEST, next_sequence_num(), payload)
         wfile.write(retry_packet.pack())
         wfile.flush()
         logger.info(f"Requested retransmission for seq={missing_seq}")
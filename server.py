@@ -2,14 +2,19 @@
 server.py
 """
 
+import os
 import socket
 import sys
 import threading
 import select
+import selectors
 import time
+import queue
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from battleship import run_multiplayer_game_online
 import struct
-from protocol import Packet, PACKET_TYPES, next_sequence_num, safe_send, safe_recv
+from protocol import Packet, PACKET_TYPES, next_sequence_num, safe_send, safe_broadcast, safe_recv, open_socket_files, connection_closed
 import state
 
 HOST = '127.0.0.1'
@@ -22,34 +27,153 @@ GAME_START_DELAY = 8  # Seconds to wait after minimum players join before starti
 INACTIVITY_TIMEOUT = 30  # Seconds before a player's turn is skipped
 GAME_END_DELAY = 10  # Seconds to wait after game ends before starting new game
 CONNECTION_TIMEOUT = 60  # Seconds before a connection is considered inactive
+MONITOR_INTERVAL = 0.5  # Seconds between disconnect checks while a game is running
+LISTEN_BACKLOG = 128  # Pending connections the kernel queues on the listening socket
+CLIENT_SOCKET_BUFFER = 32 * 1024  # Kernel send/receive buffer per client socket, in bytes
+KEEPALIVE_IDLE = 5  # Seconds of silence before the kernel starts probing a client
+KEEPALIVE_INTERVAL = 2  # Seconds between keepalive probes
+KEEPALIVE_COUNT = 3  # Unanswered probes before the kernel drops the connection
+
+# Pre-encoded messages (encoded once at load time instead of on every send)
+MSG_GAME_ENDED_QUIT = b"[INFO] Game ended due to player quit. Waiting for next game...\n\n"
+MSG_SERVER_FULL = f"[INFO] Sorry, the server has reached the maximum number of connections ({MAX_PLAYERS + MAX_SPECTATORS}). Please try again later.\n\n".encode('utf-8')
+MSG_WAITING_OPPONENT = b"[INFO] Waiting for opponent to connect...\n"
+MSG_GAME_IN_PROGRESS = b"[INFO] Current game in progress. You will receive game updates.\n"
+MSG_WAITING_GAME = b"[INFO] Waiting for game to start. You will be notified when it begins.\n"
+MSG_TIP_QUIT = b"[TIP] Type 'quit' to exit.\n\n"
+MSG_BOTH_CONNECTED = f"[INFO] Both players connected! Game will start in {GAME_START_DELAY} seconds.\n".encode('utf-8')
+MSG_NOT_ENOUGH_NEXT_GAME = "[INFO] Not enough players for next game. Disconnecting – please reconnect later.\n\n".encode('utf-8')
+MSG_GAME_START_SOON = b"[INFO] Game will start soon!\n\n"
+MSG_NOT_ENOUGH_START = b"[INFO] Not enough players to start. Disconnecting...\n"
+MSG_SHUTDOWN = b"[INFO] Server is shutting down. Disconnecting all players.\n\n"
+# Greeting lines keyed by connection number, so joining only picks the right one
+MSG_WELCOME_PLAYER = {n: f"[INFO] Welcome! You are Player {n}.\n".encode('utf-8')
+                      for n in range(1, MAX_PLAYERS + 1)}
+MSG_WELCOME_BACK = {n: f"[INFO] Welcome back! You are Player {n}.\n".encode('utf-8')
+                    for n in range(1, MAX_PLAYERS + MAX_SPECTATORS + 1)}
+# Sent on its own when a player takes back a vacated seat, hence the blank line
+MSG_WELCOME_BACK_RECONNECT = {n: msg + b"\n" for n, msg in MSG_WELCOME_BACK.items()}
+MSG_WELCOME_SPECTATOR = {n: f"[INFO] Welcome! You are Spectator {n - MAX_PLAYERS}.\n".encode('utf-8')
+                         for n in range(1, MAX_PLAYERS + MAX_SPECTATORS + 1)}
+# Game start and end notices keyed by connection number
+MSG_GAME_STARTING = {n: (f"[INFO] Game is starting! You are Player {n}.\n\n" if n <= MAX_PLAYERS else
+                         f"[INFO] Game is starting! You are Spectator {n - MAX_PLAYERS}.\n\n").encode('utf-8')
+                     for n in range(1, MAX_PLAYERS + MAX_SPECTATORS + 1)}
+MSG_GAME_ENDED = {n: ((f"[INFO] Game has ended. You were Player {n}.\n\n" if n <= MAX_PLAYERS else
+                       f"[INFO] Game has ended. You were Spectator {n - MAX_PLAYERS}.\n\n") +
+                      f"[INFO] Next game will start after the {GAME_START_DELAY} second timer ends\n\n").encode('utf-8')
+                  for n in range(1, MAX_PLAYERS + MAX_SPECTATORS + 1)}
+# Renumbering notices for the next game, keyed by player or spectator number
+MSG_PROMOTED = {n: f"[INFO] You have been promoted to Player {n} for the next game!\n\n".encode('utf-8')
+                for n in range(1, MAX_PLAYERS + 1)}
+MSG_NEXT_GAME_PLAYER = {n: f"[INFO] You will be Player {n} in the next game!\n\n".encode('utf-8')
+                        for n in range(1, MAX_PLAYERS + 1)}
+MSG_NOW_SPECTATOR = {k: f"[INFO] You are now Spectator {k}.\n\n".encode('utf-8')
+                     for k in range(1, MAX_SPECTATORS + 1)}
+MSG_NOW_SPECTATOR_NEXT_GAME = {k: msg + MSG_GAME_START_SOON for k, msg in MSG_NOW_SPECTATOR.items()}
+# Countdown announcements keyed by seconds remaining (every 5 seconds, then the last 3)
+MSG_COUNTDOWN = {i: f"[INFO] Game starting in {i} seconds...\n\n".encode('utf-8')
+                 for i in range(GAME_START_DELAY, 0, -1) if i % 5 == 0 or i <= 3}
+
+# Connection rejection messages sent from main() depending on server state
+REJECT_SUFFIX = "\n[INFO] Please type Ctrl + C to exit.\n"
+MSG_REJECT_SPECTATORS_FULL = ("[INFO] Spectator slots are full – please try again later." + REJECT_SUFFIX).encode('utf-8')
+MSG_REJECT_POST_GAME = ("[INFO] Server busy finishing last game – please try again in a few seconds." + REJECT_SUFFIX).encode('utf-8')
+MSG_REJECT_SETUP = ("[INFO] Server is setting up a new game – please try again shortly." + REJECT_SUFFIX).encode('utf-8')
+MSG_REJECT_FULL = ("[INFO] Server is full – please try again later." + REJECT_SUFFIX).encode('utf-8')
+
+# One entry of all_connections. Still a tuple, so positional unpacking and
+# indexing (e.g. in battleship.py) keep working alongside attribute access.
+Connection = namedtuple('Connection', ['conn', 'addr', 'rfile', 'wfile', 'num'])
 
 # Global variables to track connections and games
-all_connections = []  # List of (conn, addr, rfile, wfile, player_num) for all connections
+all_connections = []  # List of Connection entries (None for a disconnected player slot)
 connection_lock = threading.Lock()
-game_in_progress = False
-game_in_progress_lock = threading.Lock()
+# Serializes server.py's own sends and pre-game reads, so those threads don't steal
+# each other's ACKs. The game thread in battleship.py does its I/O without it, so
+# during a game a send from here (welcome back, monitor notices, join broadcasts)
+# can still lose its ACK to the game thread and fall back to retransmitting.
+# Snapshot all_connections under connection_lock, release it, then send under
+# send_lock. Never acquire connection_lock while holding send_lock.
+send_lock = threading.Lock()
+game_in_progress = False  # Guarded by connection_lock
+game_over_event = threading.Event()  # Set whenever game_in_progress goes False; wakes the monitor
+countdown_cancelled = threading.Event()  # Set when a player quits, so a running countdown stops
 game_ready_event = threading.Event()
-countdown_timer_running = False
-countdown_timer_lock = threading.Lock()
+# Self-pipe mirroring game_ready_event: a byte sits in it while the event is set,
+# so waiting handlers can block in select() on it alongside their client socket.
+# stop_workers() also leaves a byte in it for good, so every waiter wakes on shutdown.
+wakeup_r, wakeup_w = socket.socketpair()
+wakeup_r.setblocking(False)
 player_reconnecting = threading.Event()
 player_reconnecting.set()
+server_stopping = threading.Event()  # Set on shutdown; pooled workers return as soon as they see it
+# Connections to tear down, queued by any thread and closed by the main loop
+disconnect_queue = queue.SimpleQueue()
+
+# Shared worker pool for client handlers, the countdown/game run and the connection monitor.
+# Sized so every admitted connection can wait in handle_client while a countdown,
+# the next countdown and the monitor still get a worker.
+MAX_WORKERS = MAX_PLAYERS + MAX_SPECTATORS + 3
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="server")
+
+# current state variable; a running countdown is ServerState.COUNTDOWN
+state.set_state(state.ServerState.IDLE)
+
+def report_worker_error(future):
+    """Print any exception that escaped a pooled task, like an uncaught thread error would."""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"[ERROR] Worker failed: {future.exception()}\n")
+
+def run_in_pool(target, *args):
+    """Run target on the shared worker pool instead of spawning a new thread."""
+    future = executor.submit(target, *args)
+    future.add_done_callback(report_worker_error)
+    return future
+
+def set_game_ready():
+    """Set game_ready_event and wake every handler blocked on wakeup_r."""
+    if not game_ready_event.is_set():
+        game_ready_event.set()
+        wakeup_w.send(b'x')
+
+def clear_game_ready():
+    """Clear game_ready_event and drain wakeup_r so waiters block again."""
+    game_ready_event.clear()
+    if server_stopping.is_set():
+        return  # Keep the shutdown byte, so waiters still wake and exit
+    try:
+        while wakeup_r.recv(64):
+            pass
+    except BlockingIOError:
+        pass
 
-# current state variable
-state_lock = threading.Lock()
-state.server_state = state.ServerState.IDLE
+def stop_workers():
+    """Tell every pooled worker to finish and stop the pool without waiting for it.
+    Handlers waiting for a game wake through wakeup_r and see server_stopping."""
+    server_stopping.set()
+    try:
+        wakeup_w.send(b'x')
+    except OSError:
+        pass
+    # cancel_futures only exists from Python 3.9
+    if sys.version_info >= (3, 9):
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown(wait=False)
 
 def reset_server_state():
-    global countdown_timer_running, all_connections, game_in_progress, game_ready_event, player_reconnecting
+    global game_in_progress
 
     # Reset lists and flags
     all_connections.clear()
 
     # Reset control flags and events
-    countdown_timer_running = False
     game_in_progress = False
+    game_over_event.set()
 
     if game_ready_event.is_set():
-        game_ready_event.clear()
+        clear_game_ready()
 
     if not player_reconnecting.is_set():
         player_reconnecting.set()
@@ -65,54 +189,75 @@ def get_active_players():
         entry = all_connections[i]
         if entry is None:
             continue
-        conn, _, _, _, _ = entry
-        try:
-            # Check if socket is still connected
-            readable, _, _ = select.select([conn], [], [], 0)
-            if readable:
-                data = conn.recv(1, socket.MSG_PEEK)
-                if not data:
-                    continue  # Connection closed
+        # Check if socket is still connected
+        if not connection_closed(entry.conn):
             active.append(entry)
-        except:
-            continue  # Treat any socket error as a disconnection
     return active
 
 def cleanup_connection(conn, player_quit=False):
-    """Clean up a connection and its associated resources."""
-    with connection_lock:
-        for conn_list in [all_connections]:
-            for i, (c, _, rfile, wfile, *_) in enumerate(conn_list):
-                if c == conn:
+    """Queue a connection for cleanup by the main loop (see process_disconnects)."""
+    disconnect_queue.put(conn)
+
+def process_disconnects():
+    """Remove and close every connection queued by cleanup_connection.
+    Called from the main loop only, so removals happen one at a time in one place."""
+    while True:
+        try:
+            conn = disconnect_queue.get_nowait()
+        except queue.Empty:
+            return
+        with connection_lock:
+            for i, entry in enumerate(all_connections):
+                if entry is not None and entry.conn is conn:
                     try:
-                        rfile.close()
+                        entry.rfile.close()
                     except:
                         pass
                     try:
-                        wfile.close()
+                        entry.wfile.close()
                     except:
                         pass
-                    conn_list.pop(i)
+                    all_connections.pop(i)
                     break
-    try:
-        conn.close()
-    except:
-        pass
+        try:
+            conn.close()
+        except:
+            pass
+
+def broadcast(entries, message):
+    """Send the same message to every connection in entries, skipping empty slots.
+    The packet is built once and shared by every recipient (see safe_broadcast).
+    Pass a snapshot of all_connections and call without connection_lock held."""
+    peers = [(entry.wfile, entry.rfile) for entry in entries if entry is not None]
+    if not peers:
+        return
+    with send_lock:
+        safe_broadcast(peers, message)
 
 def handle_p1_quit(conn):
     global game_in_progress
     with connection_lock:
         print(f"[INFO] A Player has quit.\n\n")
-        # Notify all clients
-        for entry in all_connections:
-            if entry is not None:
-                _, _, rfile, wfile, _ = entry
-                safe_send(wfile, rfile, "[INFO] Game ended due to player quit. Waiting for next game...\n\n")
+        snapshot = list(all_connections)
         # Reset game state
-        game_ready_event.clear()
+        clear_game_ready()
         game_in_progress = False
+        game_over_event.set()
+        countdown_cancelled.set()
         # Clear the connection list
         all_connections.clear()
+    # Notify all clients
+    broadcast(snapshot, MSG_GAME_ENDED_QUIT)
+
+    # Nobody serves the dropped clients any more. Shutting their sockets down makes
+    # them readable, so each one's waiting handler wakes, closes it and frees its worker.
+    for entry in snapshot:
+        if entry is None or entry.conn is conn:
+            continue
+        try:
+            entry.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     try:
         conn.close()
@@ -120,30 +265,28 @@ def handle_p1_quit(conn):
         pass
 
 def reconnect_player(conn, addr):
-    """replace the disconnected player with a new connection."""
-    global all_connections, player_reconnecting
+    """replace the disconnected player with a new connection.
+    Must be called with connection_lock held, after the caller has found a vacant
+    player slot; the welcome is sent from the worker pool."""
     # Find the first available slot for the new connection
     for i in range(len(all_connections)):
         if all_connections[i] is None:
-            all_connections[i] = (conn, addr, conn.makefile('rb'), conn.makefile('wb'), i + 1)
+            all_connections[i] = Connection(conn, addr, *open_socket_files(conn), i + 1)
             # Notify the player and mark as reconnected
-            _, _, rfile, wfile, num = all_connections[i]
-            safe_send(wfile, rfile, f"[INFO] Welcome back! You are Player {num}.\n\n")
-            player_reconnecting.set()
+            run_in_pool(welcome_back, all_connections[i])
             return
-    else:
-        # No available slot, append to the list
-        print(f"[INFO] No available slot for reconnection.\n")
-    
-    # Notify the player about their new position
-    _, _, rfile, wfile, num = all_connections[i]
-    safe_send(wfile, rfile, f"[INFO] Welcome back! You are Player {num}.\n\n")
+
+def welcome_back(entry):
+    """Greet a reconnected player, then let the paused game resume."""
+    with send_lock:
+        safe_send(entry.wfile, entry.rfile, MSG_WELCOME_BACK_RECONNECT[entry.num])
     player_reconnecting.set()
 
-def check_all_connections(check_index=None):
+def check_all_connections(check_index=None, notices=None):
     """Check all connections in the server and handle disconnections appropriately.
-    If check_index is provided, only check that specific index."""
-    global all_connections, player_reconnecting
+    If check_index is provided, only check that specific index.
+    Renumbering notices for the remaining spectators are appended to notices as
+    (entry, message) pairs, for the caller to send once connection_lock is released."""
     # First, check connections without holding the lock
     disconnected_indices = []
     
@@ -155,25 +298,9 @@ def check_all_connections(check_index=None):
     
     for i in indices_to_check:
         if all_connections[i] is not None:
-            try:
-                conn, addr, rfile, wfile, num = all_connections[i]
-                
-                # Use select with a very short timeout to check if socket is readable
-                readable, _, _ = select.select([conn], [], [], 0)
-                if readable:
-                    try:
-                        # Try to peek at the socket without consuming data
-                        data = conn.recv(1, socket.MSG_PEEK)
-                        if not data:  # Empty data means connection closed
-                            print(f"[DEBUG] Connection {num} at index {i} is disconnected (empty data)")
-                            raise ConnectionResetError()
-                    except BlockingIOError:
-                        # Socket would block - this is normal for non-blocking sockets
-                        # and doesn't indicate a disconnection
-                        pass
-                    except (ConnectionResetError, OSError) as e:
-                        disconnected_indices.append((i, num))
-            except (ConnectionResetError, OSError) as e:
+            conn, addr, rfile, wfile, num = all_connections[i]
+            if connection_closed(conn):
+                print(f"[DEBUG] Connection {num} at index {i} is disconnected")
                 disconnected_indices.append((i, num))
         
     # Handle disconnections if any found
@@ -195,9 +322,10 @@ def check_all_connections(check_index=None):
                 for j in range(MAX_PLAYERS, len(all_connections)):
                     if all_connections[j] is not None:
                         spectator_count += 1
-                        conn, addr, rfile, wfile, _ = all_connections[j]
-                        all_connections[j] = (conn, addr, rfile, wfile, MAX_PLAYERS + spectator_count)
-                        safe_send(wfile, rfile, f"[INFO] You are now Spectator {spectator_count}.\n\n")
+                        entry = all_connections[j]._replace(num=MAX_PLAYERS + spectator_count)
+                        all_connections[j] = entry
+                        if notices is not None:
+                            notices.append((entry, MSG_NOW_SPECTATOR[spectator_count]))
                 print(f"[INFO] Spectator {num - MAX_PLAYERS} disconnected.\n")
         # Clear the list after processing
         disconnected_indices.clear()
@@ -207,91 +335,95 @@ def check_all_connections(check_index=None):
 
 def monitor_connections():
     """Monitor all connections and check for disconnections."""
-    global all_connections, player_reconnecting, game_in_progress
     while game_in_progress:
+        notices = []
         with connection_lock:
             # Check all connections
-            check_all_connections()
-        time.sleep(0.5)  # Sleep for a short duration before checking again
-    else:
-        return
+            check_all_connections(notices=notices)
+        if notices:
+            with send_lock:
+                for entry, message in notices:
+                    safe_send(entry.wfile, entry.rfile, message)
+        # Wait before checking again, but stop as soon as the game ends
+        if game_over_event.wait(MONITOR_INTERVAL):
+            return
     
 def handle_client(conn, addr):
     """Handle a client connection by adding it to the appropriate list."""
-    global game_in_progress, all_connections, countdown_timer_running
-    
     print(f"[INFO] New connection from {addr}\n")
     
     try:
+        # Wrap the connection with file handlers
+        rfile, wfile = open_socket_files(conn)
+        welcome = []  # Greeting lines, sent to the client together
+        start_countdown = False
         with connection_lock:
-            if len(all_connections) >= MAX_PLAYERS + MAX_SPECTATORS:
-                # Too many total connections
-                wfile = conn.makefile('wb')
-                rfile = conn.makefile('rb')
-                safe_send(wfile, rfile, f"[INFO] Sorry, the server has reached the maximum number of connections ({MAX_PLAYERS + MAX_SPECTATORS}). Please try again later.\n\n")
-                wfile.close()
-                rfile.close()
-                conn.close()
-                return
-            
-            # Wrap the connection with file handlers
-            rfile = conn.makefile('rb')
-            wfile = conn.makefile('wb')
-            
-            # Add to main list, reusing None slots if available
-            connection_num = None
-            for i in range(len(all_connections)):
-                if all_connections[i] is None:
-                    connection_num = i + 1
-                    all_connections[i] = (conn, addr, rfile, wfile, connection_num)
-                    break
-            if connection_num is None:
-                connection_num = len(all_connections) + 1
-                all_connections.append((conn, addr, rfile, wfile, connection_num))
-
-            # Determine if they're an active player or spectator
-            if connection_num <= MAX_PLAYERS and not game_in_progress:
-                safe_send(wfile, rfile, f"[INFO] Welcome! You are Player {connection_num}.\n")
-                if connection_num < MAX_PLAYERS:
-                    safe_send(wfile, rfile, f"[INFO] Waiting for opponent to connect...\n")
-            else:
-                if game_in_progress and not player_reconnecting.is_set():
-                    # If game is in progress and player reconnects
-                    safe_send(wfile, rfile, f"[INFO] Welcome back! You are Player {connection_num}.\n")
-                    player_reconnecting.set()
-                else:
-                    safe_send(wfile, rfile, f"[INFO] Welcome! You are Spectator {connection_num - MAX_PLAYERS}.\n")
-                if game_in_progress:
-                    safe_send(wfile, rfile, f"[INFO] Current game in progress. You will receive game updates.\n")
+            server_full = len(all_connections) >= MAX_PLAYERS + MAX_SPECTATORS
+            if not server_full:
+                # Add to main list, reusing None slots if available
+                connection_num = None
+                for i in range(len(all_connections)):
+                    if all_connections[i] is None:
+                        connection_num = i + 1
+                        all_connections[i] = Connection(conn, addr, rfile, wfile, connection_num)
+                        break
+                if connection_num is None:
+                    connection_num = len(all_connections) + 1
+                    all_connections.append(Connection(conn, addr, rfile, wfile, connection_num))
+
+                # Determine if they're an active player or spectator
+                if connection_num <= MAX_PLAYERS and not game_in_progress:
+                    welcome.append(MSG_WELCOME_PLAYER[connection_num])
+                    if connection_num < MAX_PLAYERS:
+                        welcome.append(MSG_WAITING_OPPONENT)
                 else:
-                    safe_send(wfile, rfile, f"[INFO] Waiting for game to start. You will be notified when it begins.\n")
-            
-            safe_send(wfile, rfile, "[TIP] Type 'quit' to exit.\n\n")
-            
-            # Notify all connected clients (skip empty slots)
-            for entry in all_connections:
-                if entry is None:
-                    continue
-                c, _, rf, wf, _ = entry
-                if c != conn:
-                    safe_send(wf, rf, f"[INFO] New connection from {addr[0]}:{addr[1]}. ({len(all_connections)}/{MAX_PLAYERS + MAX_SPECTATORS} total connections)\n")
-            
-            # Check if ready to start countdown
-            active_players = get_active_players()
-            if len(active_players) == MAX_PLAYERS and not game_in_progress:
-                with countdown_timer_lock:
-                    if not countdown_timer_running:
-                        countdown_timer_running = True
-                        for entry in all_connections:
-                            if entry is None:
-                                continue
-                            _, _, rf, wf, _ = entry
-                            safe_send(wf, rf, f"[INFO] Both players connected! Game will start in {GAME_START_DELAY} seconds.\n")
-                        
-                        # Start countdown thread
-                        start_timer_thread = threading.Thread(target=start_game_countdown)
-                        start_timer_thread.daemon = True
-                        start_timer_thread.start()
+                    if game_in_progress and not player_reconnecting.is_set():
+                        # If game is in progress and player reconnects
+                        welcome.append(MSG_WELCOME_BACK[connection_num])
+                        player_reconnecting.set()
+                    else:
+                        welcome.append(MSG_WELCOME_SPECTATOR[connection_num])
+                    if game_in_progress:
+                        welcome.append(MSG_GAME_IN_PROGRESS)
+                    else:
+                        welcome.append(MSG_WAITING_GAME)
+                welcome.append(MSG_TIP_QUIT)
+
+                # Snapshot the other clients and the totals for the notifications below
+                others = [entry for entry in all_connections if entry is not None and entry.conn is not conn]
+                total = len(all_connections)
+
+                # Check if ready to start countdown
+                active_players = get_active_players()
+                if len(active_players) == MAX_PLAYERS and not game_in_progress:
+                    # Only the handler that wins IDLE -> COUNTDOWN starts the countdown.
+                    # Clear the cancel flag here, under connection_lock, so a quit that
+                    # lands before the worker starts still cancels it.
+                    if state.transition(state.ServerState.IDLE, state.ServerState.COUNTDOWN):
+                        countdown_cancelled.clear()
+                        start_countdown = True
+                        snapshot = list(all_connections)
+
+        # Socket I/O happens after connection_lock is released
+        if server_full:
+            # Too many total connections
+            safe_send(wfile, rfile, MSG_SERVER_FULL)
+            wfile.close()
+            rfile.close()
+            conn.close()
+            return
+
+        # Send the whole greeting as one packet (one write and one ACK wait)
+        with send_lock:
+            safe_send(wfile, rfile, b"".join(welcome))
+
+        # Notify all other connected clients
+        broadcast(others, f"[INFO] New connection from {addr[0]}:{addr[1]}. ({total}/{MAX_PLAYERS + MAX_SPECTATORS} total connections)\n")
+
+        if start_countdown:
+            broadcast(snapshot, MSG_BOTH_CONNECTED)
+            # Start countdown on the worker pool
+            run_in_pool(start_game_countdown)
 
     except Exception as e:
         print(f"[ERROR] Connection setup error: {e}\n\n")
@@ -302,10 +434,19 @@ def handle_client(conn, addr):
         # Main loop while waiting for game to start
         waiting_for_game = True
         while waiting_for_game and not game_in_progress:
-            ready, _, _ = select.select([conn], [], [], 0.5)
-            if ready:
-                cmd = rfile.readline().strip().upper()
-                if cmd == 'QUIT':
+            # Block until the client sends something or the game is ready
+            ready, _, _ = select.select([conn, wakeup_r], [], [])
+            if server_stopping.is_set():
+                return
+            if conn in ready:
+                # Read under send_lock so we never steal an ACK a broadcast is waiting for
+                with send_lock:
+                    if not select.select([conn], [], [], 0)[0]:
+                        continue
+                    if not conn.recv(1, socket.MSG_PEEK):
+                        raise ConnectionResetError("connection closed by client")
+                    cmd = safe_recv(rfile, wfile, timeout=0)
+                if cmd and cmd.strip().upper() == 'QUIT':
                     print(f"[INFO] {addr} has quit.\n\n")
                     handle_p1_quit(conn)
                     return
@@ -314,6 +455,16 @@ def handle_client(conn, addr):
                 waiting_for_game = False
 
     except Exception as e:
+        with connection_lock:
+            dropped = not any(entry is not None and entry.conn is conn for entry in all_connections)
+        if dropped:
+            # Another client quit and handle_p1_quit shut this socket down; just let it go
+            for f in (rfile, wfile, conn):
+                try:
+                    f.close()
+                except:
+                    pass
+            return
         print(f"[INFO] {addr} disconnected while waiting: {e}\n\n")
         handle_p1_quit(conn)
         return
@@ -321,253 +472,279 @@ def handle_client(conn, addr):
     with connection_lock:
         # remove spectators; check if both players still connected
         players_connected = [c for c in all_connections[:MAX_PLAYERS] if c]
-        if len(players_connected) < MAX_PLAYERS:
-            # not enough players – kick the leftover socket(s) and reset
-            for entry in players_connected:
-                _, _, rf, wf, _ = entry
-                safe_send(wf, rf, "[INFO] Not enough players for next game. Disconnecting – please reconnect later.\n\n")
-                try: entry[0].close()
-                except: pass
-            all_connections.clear()
+        if len(players_connected) >= MAX_PLAYERS:
+            return
+        all_connections.clear()
+    # not enough players – kick the leftover socket(s) and reset
+    broadcast(players_connected, MSG_NOT_ENOUGH_NEXT_GAME)
+    for entry in players_connected:
+        try: entry.conn.close()
+        except: pass
+
+def compact_connections():
+    """Renumber all connections for the next game in a single pass.
+    Remaining players keep their order, vacant player slots are filled from the
+    front of the spectator queue. Returns one (entry, message) notice per client
+    telling them their new number, to be sent once connection_lock is released.
+    Must be called with connection_lock held."""
+    new_order = [entry for entry in all_connections if entry is not None]
+    all_connections.clear()
+    notices = []
+    for i, entry in enumerate(new_order):
+        num = i + 1
+        old_num = entry.num
+        entry = entry._replace(num=num)
+        all_connections.append(entry)
+        if num <= MAX_PLAYERS:
+            if old_num > MAX_PLAYERS:
+                notices.append((entry, MSG_PROMOTED[num]))
+            else:
+                notices.append((entry, MSG_NEXT_GAME_PLAYER[num]))
+        else:
+            notices.append((entry, MSG_NOW_SPECTATOR_NEXT_GAME[num - MAX_PLAYERS]))
+    return notices
 
 def start_game_countdown():
-    """Start a countdown timer before the game begins."""
-    global game_in_progress, countdown_timer_running
-    
+    """Start a countdown timer before the game begins.
+    Runs with the server in ServerState.COUNTDOWN; the caller that claimed it has
+    already cleared countdown_cancelled. Returns the server to IDLE unless the
+    next game's countdown has been handed off."""
+    global game_in_progress
+    next_countdown = False
+
     try:
-        for i in range(GAME_START_DELAY, 0, -1):
-            if i % 5 == 0 or i <= 3:
-            # Wait until next announcement
-            # Send countdown message to all players
+        # Announcements are timed against one monotonic deadline, so time spent
+        # waiting for ACKs doesn't push the game start back
+        deadline = time.monotonic() + GAME_START_DELAY
+        # Only wake at the announcement points, then once more at the deadline (0)
+        for i in sorted(MSG_COUNTDOWN, reverse=True) + [0]:
+            # Wait until next announcement, stopping early if a player quits
+            if countdown_cancelled.wait(max(0, deadline - i - time.monotonic())):
+                print("[INFO] Countdown cancelled.\n")
+                return
+            if i:
+                # Send countdown message to all players
                 with connection_lock:
-                    for entry in all_connections:
-                        if entry is None:
-                            continue
-                        _, _, rf, wf, _ = entry
-                        safe_send(wf, rf, f"[INFO] Game starting in {i} seconds...\n\n")
-            time.sleep(1)
+                    snapshot = list(all_connections)
+                broadcast(snapshot, MSG_COUNTDOWN[i])
         
-        with game_in_progress_lock:
+        with connection_lock:
+            if countdown_cancelled.is_set():
+                print("[INFO] Countdown cancelled.\n")
+                return
             game_in_progress = True
-            game_ready_event.set()
-            countdown_timer_running = False
-        
+            game_over_event.clear()
+            set_game_ready()
+            snapshot = list(all_connections)
+
         # Notify all players that the game is starting
-        with connection_lock:
-            for entry in all_connections:
+        with send_lock:
+            for entry in snapshot:
                 if entry is None:
                     continue
-                _, _, rf, wf, num = entry
-                if num <= MAX_PLAYERS:
-                    safe_send(wf, rf, f"[INFO] Game is starting! You are Player {num}.\n\n")
-                else:
-                    safe_send(wf, rf, f"[INFO] Game is starting! You are Spectator {num - MAX_PLAYERS}.\n\n")
+                safe_send(entry.wfile, entry.rfile, MSG_GAME_STARTING[entry.num])
 
         print(f"[DEBUG] monitor connections thread started")
-        # start check connections thread
-        check_connections_thread = threading.Thread(target=monitor_connections)
-        check_connections_thread.daemon = True
-        check_connections_thread.start()
+        # start check connections worker
+        run_in_pool(monitor_connections)
 
         run_multiplayer_game_online(player_reconnecting, all_connections)
 
         print(f"[DEBUG] Game finished")
         # mark server as in post-game cleanup phase
-        state.server_state = state.ServerState.POST_GAME
+        state.set_state(state.ServerState.POST_GAME)
 
         # After game ends, notify all players
         with connection_lock:
-            for entry in all_connections:
+            snapshot = list(all_connections)
+        with send_lock:
+            for entry in snapshot:
                 if entry is None:
                     continue
-                _, _, rf, wf, num = entry
-                if num <= MAX_PLAYERS:
-                    safe_send(wf, rf, f"[INFO] Game has ended. You were Player {num}.\n\n[INFO] Next game will start after the {GAME_START_DELAY} second timer ends\n\n")
-                else:
-                    safe_send(wf, rf, f"[INFO] Game has ended. You were Spectator {num - MAX_PLAYERS}.\n\n[INFO] Next game will start after the {GAME_START_DELAY} second timer ends\n\n")
+                safe_send(entry.wfile, entry.rfile, MSG_GAME_ENDED[entry.num])
         
         # Wait before starting new game
         time.sleep(GAME_END_DELAY)
-        # Reset game state
-        with game_in_progress_lock:
-            game_in_progress = False
-        # Handle next game players
         with connection_lock:
+            # Reset game state
+            game_in_progress = False
+            game_over_event.set()
+            # Handle next game players
             # Check and remove disconnected players
             for i in range(MAX_PLAYERS):  # Only check first two indices
-                if all_connections[i] is not None:  # Only check if connection exists
+                if i < len(all_connections) and all_connections[i] is not None:  # Only check if connection exists
                     if check_all_connections(i):  # Check specific index
                         print(f"[INFO] Connection {i} has disconnected.\n")
             
-            # Handle player 2 position
-            if all_connections[0] is None:  # If P1 left
-                # Move P2 to P1 position
-                all_connections[0] = all_connections[1]
-                all_connections[1] = None
-                # Notify the player about their new position
-                _, _, rfile, wfile, _ = all_connections[0]
-                safe_send(wfile, rfile, f"[INFO] You will be Player 1 in the next game!\n\n")
-            
-            # Promote spectators to fill vacant player slots
-            vacant_slots = [i for i in range(MAX_PLAYERS) if all_connections[i] is None]
-            print(f"[DEBUG] vacant_slots: {vacant_slots}")
-            if vacant_slots:  # If we have any vacant player slots
-                # Find the first spectators to promote
-                for slot in vacant_slots:
-                    # Look for the first spectator (index >= MAX_PLAYERS)
-                    for i in range(MAX_PLAYERS, len(all_connections)):
-                        if all_connections[i] is not None:
-                            # Move this spectator to the vacant player slot
-                            all_connections[slot] = all_connections[i]
-                            all_connections.pop(i)
-                            # Notify the promoted spectator
-                            _, _, rfile, wfile, _ = all_connections[slot]
-                            safe_send(wfile, rfile, f"[INFO] You have been promoted to Player {slot + 1} for the next game!\n\n")
-                            break
-            
-            # Update remaining spectator positions
-            spectator_count = 0
-            for i in range(MAX_PLAYERS, len(all_connections)):
-                if all_connections[i] is not None:
-                    spectator_count += 1
-                    conn, addr, rfile, wfile, _ = all_connections[i]
-                    all_connections[i] = (conn, addr, rfile, wfile, MAX_PLAYERS + spectator_count)
-                    safe_send(wfile, rfile, f"[INFO] You are now Spectator {spectator_count}.\n\n")
-            
-            # Update player numbers
-            for i in range(len(all_connections)):
-                if all_connections[i] is not None:  # Only update if connection exists
-                    conn, addr, rfile, wfile, _ = all_connections[i]
-                    all_connections[i] = (conn, addr, rfile, wfile, i + 1)
-                    if i < MAX_PLAYERS:
-                        safe_send(wfile, rfile, f"[INFO] You will be Player {i + 1} in the next game!\n\n")
-                    else:
-                        safe_send(wfile, rfile, f"[INFO] Game will start soon!\n\n")
+            # Renumber everyone for the next game
+            notices = compact_connections()
+        with send_lock:
+            for entry, message in notices:
+                safe_send(entry.wfile, entry.rfile, message)
 
         # Start countdown for next game if we have enough players
         active_players = get_active_players()
         if len(active_players) == MAX_PLAYERS:
             print("[DEBUG] Attempting to start next game countdown")
-            with countdown_timer_lock:
-                if not countdown_timer_running:
-                    countdown_timer_running = True
-                    start_timer_thread = threading.Thread(target=start_game_countdown)
-                    start_timer_thread.daemon = True
-                    start_timer_thread.start()
-                    with state_lock:
-                        state.server_state = state.ServerState.COUNTDOWN
-                else:
-                    print("[DEBUG] Countdown already running")
+            with connection_lock:
+                # Clear the cancel flag as the countdown is claimed, like handle_client does
+                next_countdown = state.transition(state.ServerState.POST_GAME, state.ServerState.COUNTDOWN)
+                if next_countdown:
+                    countdown_cancelled.clear()
+            if next_countdown:
+                run_in_pool(start_game_countdown)
+            else:
+                print("[DEBUG] Countdown already running")
 
         else:
             with connection_lock:
-                player1_entry = all_connections[0]
+                player1_entry = all_connections[0] if all_connections else None
                 if player1_entry is not None:
-                    conn, _, rfile, wfile, _ = player1_entry
-                    try:
-                        safe_send(wfile, rfile, "[INFO] Not enough players to start. Disconnecting...\n")
-                    except Exception as e:
-                        print(f"[WARN] Failed to send disconnect message: {e}")
-                    try:
-                        conn.close()
-                    except Exception as e:
-                        print(f"[WARN] Failed to close socket: {e}")
                     all_connections[0] = None
+            if player1_entry is not None:
+                conn, _, rfile, wfile, _ = player1_entry
+                try:
+                    with send_lock:
+                        safe_send(wfile, rfile, MSG_NOT_ENOUGH_START)
+                except Exception as e:
+                    print(f"[WARN] Failed to send disconnect message: {e}")
+                try:
+                    conn.close()
+                except Exception as e:
+                    print(f"[WARN] Failed to close socket: {e}")
 
-            with state_lock:
-                print("[DEBUG] Resetting server state")
-                reset_server_state()
-                state.server_state = state.ServerState.IDLE
+            print("[DEBUG] Resetting server state")
+            reset_server_state()
+            state.set_state(state.ServerState.IDLE)
     
     except Exception as e:
         print(f"[ERROR] Error in game countdown: {e}\n")
     finally:
-        with countdown_timer_lock:
-            countdown_timer_running = False
-            state.server_state = state.ServerState.IDLE
+        # Leave COUNTDOWN alone if it now belongs to the next game's countdown
+        if not next_countdown:
+            state.set_state(state.ServerState.IDLE)
+
+def configure_client_socket(conn):
+    """Apply per-connection socket options to an accepted client socket."""
+    # Every packet is small and waits for an ACK, so don't let Nagle hold it back
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # Let the kernel probe idle connections so dead clients are eventually detected
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Probe well before the OS default of two hours, where the platform allows tuning it
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
+    # Packets are a few hundred bytes at most, so cap the kernel buffers instead of
+    # letting them autotune to megabytes on long-lived, mostly idle connections
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_SOCKET_BUFFER)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CLIENT_SOCKET_BUFFER)
+
+def accept_connection(conn, addr):
+    """Route a newly accepted connection: reconnect a player, hand it to a client
+    thread, or reject it depending on the current server state."""
+    with connection_lock:
+        print(f"[DEBUG] Incoming connection from {addr}; server_state = {state.server_state}")
 
-def main():
-    global server_state
-    print(f"[INFO] Server listening on {HOST}:{PORT}\n")
-    print(f"[INFO] Waiting for {MAX_SPECTATORS} players to connect...\n")
-    
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        # Set socket options to allow reuse of address
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((HOST, PORT))
-        server_socket.listen(MAX_PLAYERS + MAX_SPECTATORS)
-        
-        # Set socket to non-blocking mode
-        server_socket.setblocking(False)
-        
-        try:
-            while True:
-                try:
-                    conn, addr = server_socket.accept()
-                except BlockingIOError:
-                    # No incoming connection at the moment
-                    time.sleep(0.1)
-                    continue
+        vacant_player = next((i for i in range(MAX_PLAYERS)
+                            if i < len(all_connections) and all_connections[i] is None), None)
 
-                with connection_lock:
-                    print(f"[DEBUG] Incoming connection from {addr}; server_state = {state.server_state}")
+        # RECONNECTION
+        if vacant_player is not None:
+            reconnect_player(conn, addr)
+            # Resume a paused game, but leave POST_GAME alone so the next countdown can still start
+            state.transition(state.ServerState.SETUP, state.ServerState.IN_GAME)
+            return
 
-                    vacant_player = next((i for i in range(MAX_PLAYERS)
-                                        if i < len(all_connections) and all_connections[i] is None), None)
+        # FRESH GAME (joining during the countdown is still joining the lobby)
+        if state.server_state in (state.ServerState.IDLE, state.ServerState.COUNTDOWN):
+            run_in_pool(handle_client, conn, addr)
+            return
 
-                    # RECONNECTION
-                    if vacant_player is not None:
-                        reconnect_player(conn, addr)
-                        state.server_state = state.ServerState.IN_GAME
-                        continue
+        # IN-GAME SPECTATOR JOIN
+        elif state.server_state is state.ServerState.IN_GAME:
+            if len(all_connections) < MAX_PLAYERS + MAX_SPECTATORS:
+                run_in_pool(handle_client, conn, addr)
+                return
+            else:
+                reason = MSG_REJECT_SPECTATORS_FULL
 
-                    # FRESH GAME
-                    if state.server_state is state.ServerState.IDLE:
-                        client_thread = threading.Thread(target=handle_client, args=(conn, addr))
-                        client_thread.daemon = True
-                        client_thread.start()
-                        continue
+        # CLEANUP PHASE
+        elif state.server_state is state.ServerState.POST_GAME:
+            reason = MSG_REJECT_POST_GAME
+
+        # SETUP PHASE
+        elif state.server_state is state.ServerState.SETUP:
+            reason = MSG_REJECT_SETUP
 
-                    # IN-GAME SPECTATOR JOIN
-                    elif state.server_state is state.ServerState.IN_GAME:
-                        if len(all_connections) < MAX_PLAYERS + MAX_SPECTATORS:
-                            client_thread = threading.Thread(target=handle_client, args=(conn, addr))
-                            client_thread.daemon = True
-                            client_thread.start()
-                            continue
-                        else:
-                            reason = "Spectator slots are full – please try again later."
+        else:
+            reason = MSG_REJECT_FULL
 
-                    # CLEANUP PHASE
-                    elif state.server_state is state.ServerState.POST_GAME:
-                        reason = "Server busy finishing last game – please try again in a few seconds."
+    # Reject outside connection_lock
+    reject_connection(conn, reason)
 
-                    # SETUP PHASE
-                    elif state.server_state is state.ServerState.SETUP:
-                        reason = "Server is setting up a new game – please try again shortly."
+def reject_connection(conn, reason):
+    """Send a rejection message to a connection that won't be admitted and close it.
+    Runs on the accept loop, so the notice is written once without blocking or waiting
+    for an ACK, and a burst of rejections never ties up the worker pool."""
+    try:
+        conn.setblocking(False)
+        conn.send(Packet(PACKET_TYPES['SYSTEM_MESSAGE'], next_sequence_num(), reason).pack())
+        # Send FIN right behind the notice; the client reads it before it ACKs
+        conn.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    conn.close()
+
+def create_server_socket():
+    """Open the listening socket for HOST:PORT.
+    No SO_REUSEPORT, so a second server on the same port fails to bind instead of
+    silently sharing incoming clients with this one."""
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Set socket options to allow reuse of address
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((HOST, PORT))
+    # Queue well beyond the connection limit so a burst of joins isn't refused;
+    # connections over the limit are still turned away with a message
+    server_socket.listen(LISTEN_BACKLOG)
+    # Set socket to non-blocking mode and let the selector wake us on new connections
+    server_socket.setblocking(False)
+    return server_socket
 
-                    else:
-                        reason = "Server is full – please try again later."
-
-                    # Reject connection
-                    wfile = conn.makefile('wb')
-                    rfile = conn.makefile('rb')
-                    safe_send(wfile, rfile, f"[INFO] {reason}\n[INFO] Please type Ctrl + C to exit.\n")
-                    wfile.close()
-                    rfile.close()
-                    conn.close()
+def main():
+    print(f"[INFO] Server listening on {HOST}:{PORT}\n")
+    print(f"[INFO] Waiting for {MAX_SPECTATORS} players to connect...\n")
+    
+    with selectors.DefaultSelector() as sel:
+        server_socket = create_server_socket()
+        sel.register(server_socket, selectors.EVENT_READ)
+        
+        try:
+            while True:
+                # Block until the listening socket is readable; the timeout keeps Ctrl + C responsive
+                for key, _ in sel.select(timeout=1.0):
+                    try:
+                        conn, addr = key.fileobj.accept()
+                    except BlockingIOError:
+                        # The client gave up before we accepted it
+                        continue
+                    configure_client_socket(conn)
+                    accept_connection(conn, addr)
+                # Tear down connections other threads have given up on
+                process_disconnects()
                     
         except KeyboardInterrupt:
             print("\n[INFO] Server shutting down...\n")
-            # Notify all connected players
+            # Notify all connected players. Frame the notice once and write the same
+            # bytes to everyone without waiting for ACKs, since we're about to close.
+            shutdown_packet = Packet(PACKET_TYPES['SYSTEM_MESSAGE'], next_sequence_num(), MSG_SHUTDOWN).pack()
             with connection_lock:
                 for entry in all_connections:
                     if entry is None:
                         continue
-                    _, _, _, wfile, _ = entry
                     try:
-                        wfile.write(b"[INFO] Server is shutting down. Disconnecting all players.\n\n")
-                        wfile.flush()
+                        entry.wfile.write(shutdown_packet)
+                        entry.wfile.flush()
                     except:
                         pass
                 # Close all connections
@@ -589,9 +766,18 @@ def main():
                         pass
                 all_connections.clear()
             print("[INFO] All connections closed. Server shutdown complete.\n")
-            sys.exit(0)
+            exit_code = 0
         except Exception as e:
             print(f"[ERROR] Server error: {e}\n")
+            exit_code = 1
+        finally:
+            server_socket.close()
+
+    # Pool workers are not daemon threads, so skip the interpreter's join-at-exit
+    # instead of waiting for a game or handlers that may still be blocked on I/O
+    stop_workers()
+    sys.stdout.flush()
+    os._exit(exit_code)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
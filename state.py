@@ -1,3 +1,4 @@
+import threading
 from enum import Enum, auto
 
 # Server state management
@@ -8,4 +9,21 @@ class ServerState(Enum):
     IN_GAME       = auto()   # game_in_progress == True
     POST_GAME     = auto()   # cleaning up after a game, no new connections
 
-server_state = ServerState.IDLE
\ No newline at end of file
+server_state = ServerState.IDLE
+state_lock = threading.Lock()
+
+def set_state(new_state):
+    """Unconditionally move the server to new_state."""
+    global server_state
+    with state_lock:
+        server_state = new_state
+
+def transition(from_state, to_state):
+    """Move the server from from_state to to_state if that is the current state.
+    Returns True if the transition happened, so only one caller can win it."""
+    global server_state
+    with state_lock:
+        if server_state is not from_state:
+            return False
+        server_state = to_state
+        return True
@@ -1,12 +1,11 @@
+import math
 import random
 import protocol
 import socket
-import threading
 import time
 import logging
 from datetime import datetime
 import select
-import struct
 import zlib
 
 # Add SUCCESS level to logging
@@ -36,43 +35,57 @@ logger.addHandler(results_handler)
 logger.propagate = False
 
 def inject_errors(data, error_rate=0.1):
-    """Randomly flip bits in the data with given error rate."""
+    """Randomly flip bits in the data with given error rate.
+    Returns a bytearray; Packet.unpack reads it in place like bytes."""
     result = bytearray(data)
+    if error_rate <= 0:
+        return result
+
+    # Each byte is hit independently, so the gap to the next hit is geometric.
+    # Jumping from hit to hit only spends a Python iteration on corrupted bytes.
+    log_miss = math.log1p(-error_rate) if error_rate < 1 else float('-inf')
+    log, rand, randbits = math.log, random.random, random.getrandbits
+    size = len(result)
     
     # Only inject errors in the payload portion
-    for i in range(6, len(result)):  # Skip header (first 6 bytes)
-        if random.random() < error_rate:
-            # Flip a single bit
-            bit_to_flip = 1 << random.randint(0, 7)
-            result[i] ^= bit_to_flip
+    i = 6 + int(log(1.0 - rand()) / log_miss)  # Skip header (first 6 bytes)
+    while i < size:
+        # Flip a single bit; getrandbits(3) picks 0-7 in one draw
+        result[i] ^= 1 << randbits(3)
+        i += 1 + int(log(1.0 - rand()) / log_miss)
     
-    return bytes(result)
+    return result
+
+def _socket_pair():
+    """An in-process duplex link over socket.socketpair(): (rfile1, wfile1, rfile2, wfile2).
+    What side 1 writes, side 2 reads, and vice versa. Sockets rather than pipes, since
+    select() only accepts sockets on Windows. As with open_socket_files, the read ends
+    are unbuffered so select() on their fds sees every unread packet. The write ends
+    are unbuffered too: every write is flushed at once, so each packet goes straight
+    to the socket in one write and flush() has nothing to do."""
+    s1, s2 = socket.socketpair()
+    return (s1.makefile('rb', buffering=0), s1.makefile('wb', buffering=0),
+            s2.makefile('rb', buffering=0), s2.makefile('wb', buffering=0))
 
 def test_packet_corruption():
     """Test how well our protocol detects corrupted packets."""
     logger.info("Test commencing: Packet Corruption Detection")
-    # Create test socket pair
-    s1, s2 = socket.socketpair()
     
     # Test parameters
-    num_packets = 1000
     error_rates = [0.01, 0.05, 0.1, 0.2]
+    num_packets = 1000
+    
+    # Every packet starts out the same, so pack it once with a fixed payload size
+    payload = b'X' * 40  # Use consistent payload size
+    data = protocol.Packet(protocol.PACKET_TYPES['SYSTEM_MESSAGE'], 1, payload).pack()
+    unpack = protocol.Packet.unpack
     
     results = {}
     for error_rate in error_rates:
         corrupted = 0
         for _ in range(num_packets):
-            # Create and send packet with a fixed payload size
-            payload = b'X' * 40  # Use consistent payload size
-            packet = protocol.Packet(protocol.PACKET_TYPES['SYSTEM_MESSAGE'], 1, payload)
-            data = packet.pack()
-            
-            # Inject errors
-            corrupted_data = inject_errors(data, error_rate)
-            
-            # Try to unpack
-            result = protocol.Packet.unpack(corrupted_data)
-            if result is None:
+            # Inject errors, then try to unpack
+            if unpack(inject_errors(data, error_rate)) is None:
                 corrupted += 1
                 
         detection_rate = (corrupted / num_packets) * 100
@@ -83,11 +96,7 @@ def test_packet_corruption():
 def test_sequence_validation():
     """Test sequence number validation and out-of-order packet handling."""
     logger.info("Test commencing: Sequence Validation")
-    s1, s2 = socket.socketpair()
-    rfile1 = s1.makefile('rb')
-    wfile1 = s1.makefile('wb')
-    rfile2 = s2.makefile('rb')
-    wfile2 = s2.makefile('wb')
+    rfile1, wfile1, rfile2, wfile2 = _socket_pair()
     
     # Create packets in sequence order but send them out of order (3,1,4,2)
     packets = [
@@ -101,57 +110,47 @@ def test_sequence_validation():
     received = []
     received_sequence = []  # Track the order in which packets were received
     expected_sequence = 1  # Track the next expected sequence number
-    buffered_packets = {}  # Buffer for out-of-order packets
+    buffered_packets = [None] * 256  # Buffer for out-of-order packets, one slot per sequence number
     
-    # Start ACK handler thread that runs for all packets
+    # ACK handler for the receiving end; the socket buffers each packet, so it runs inline after every send
     def ack_handler():
         try:
-            while True:
-                # Read the packet
-                header = rfile2.read(6)  # Changed from 9 to 6
-                if not header:
-                    break
-                    
-                packet_type, seq_num, checksum, payload_len = struct.unpack('!BBHH', header)  # Changed from BBLHB to BBHH
+            # Read the packet
+            header = rfile2.read(protocol.HEADER.size)
+            if header:
+                packet_type, seq_num, checksum, payload_len = protocol.HEADER.unpack(header)
                 payload = rfile2.read(payload_len)
                 
                 # Send ACK immediately
-                ack_packet = protocol.Packet(protocol.PACKET_TYPES['ACK'], seq_num, b'')
-                wfile2.write(ack_packet.pack())
-                wfile2.flush()
+                protocol.send_ack(wfile2, seq_num)
         except Exception as e:
             logger.error(f"Error in ACK handler: {str(e)}")
     
-    # Start ACK handler in a separate thread
-    ack_thread = threading.Thread(target=ack_handler)
-    ack_thread.daemon = True
-    ack_thread.start()
-    
     def process_buffered_packets():
         """Process any buffered packets that can be handled in sequence."""
         nonlocal expected_sequence, received
-        while expected_sequence in buffered_packets:
+        while buffered_packets[expected_sequence] is not None:
             packet = buffered_packets[expected_sequence]
             received.append(packet.payload.decode('utf-8'))
-            del buffered_packets[expected_sequence]
-            expected_sequence += 1
+            buffered_packets[expected_sequence] = None
+            expected_sequence = (expected_sequence + 1) % 256
     
     # Send packets in the specified order (3,1,4,2)
     for packet in packets:
         # Send packet
         wfile1.write(packet.pack())
-        wfile1.flush()
+        ack_handler()
         
         # Wait for ACK with timeout
         start_time = time.time()
         ack_received = False
         while time.time() - start_time < 1.0:  # 1 second timeout
             try:
-                readable, _, _ = select.select([rfile1.fileno()], [], [], 0.1)
+                readable, _, _ = select.select([rfile1.fileno()], [], [], max(0, start_time + 1.0 - time.time()))
                 if readable:
-                    header = rfile1.read(6)  # Changed from 9 to 6
+                    header = rfile1.read(protocol.HEADER.size)
                     if header:
-                        packet_type, ack_seq, _, _ = struct.unpack('!BBHH', header)  # Changed from BBLHB to BBHH
+                        packet_type, ack_seq, _, _ = protocol.HEADER.unpack(header)
                         if packet_type == protocol.PACKET_TYPES['ACK'] and (ack_seq % 256) == (packet.sequence_num % 256):
                             # Track the sequence in which packets were received
                             received_sequence.append(packet.sequence_num)
@@ -162,7 +161,7 @@ def test_sequence_validation():
                                 expected_sequence = (packet.sequence_num + 1) % 256
                                 process_buffered_packets()
                             else:
-                                buffered_packets[packet.sequence_num] = packet
+                                buffered_packets[packet.sequence_num % 256] = packet
                             ack_received = True
                             break
             except Exception as e:
@@ -175,9 +174,6 @@ def test_sequence_validation():
     # Process any remaining buffered packets
     process_buffered_packets()
     
-    # Wait for ACK handler to complete
-    ack_thread.join(timeout=0.1)
-    
     logger.success(f"Sequence validation test: {len(received)} packets received")
     logger.success(f"Packets received in sequence: {received_sequence}")
     logger.success(f"Packets processed in order: {received}")
@@ -187,20 +183,16 @@ def test_sequence_validation():
 def test_retransmission():
     """Test retransmission mechanism."""
     logger.info("Test commencing: Retransmission")
-    s1, s2 = socket.socketpair()
-    rfile1 = s1.makefile('rb')
-    wfile1 = s1.makefile('wb')
-    rfile2 = s2.makefile('rb')
-    wfile2 = s2.makefile('wb')
+    rfile1, wfile1, rfile2, wfile2 = _socket_pair()
     
-    # Start ACK handler thread
+    # ACK handler for the receiving end; the socket holds the original and every retry until it runs
     def ack_handler():
         try:
             # Read the packet
-            header = rfile2.read(6)  # Changed from 9 to 6
+            header = rfile2.read(protocol.HEADER.size)
             if header:
                 # Get payload length from header
-                packet_type, seq_num, checksum, payload_len = struct.unpack('!BBHH', header)  # Changed from BBLHB to BBHH
+                packet_type, seq_num, checksum, payload_len = protocol.HEADER.unpack(header)
                 # Read the payload
                 payload = rfile2.read(payload_len)
                 # Don't send ACK to test retransmission
@@ -210,27 +202,22 @@ def test_retransmission():
         except Exception as e:
             logger.error(f"Error in ACK handler: {str(e)}")
     
-    # Start ACK handler in a separate thread
-    ack_thread = threading.Thread(target=ack_handler)
-    ack_thread.daemon = True
-    ack_thread.start()
-    
     # Send packet using safe_send to test retransmission
     success = protocol.safe_send(wfile1, rfile1, "test message", protocol.PACKET_TYPES['SYSTEM_MESSAGE'])
     
-    # Wait for retransmission
-    time.sleep(0.2)
+    # Consume the original transmission
+    ack_handler()
     
     # Check if packet was retransmitted
     retransmitted = False
     start_time = time.time()
     while time.time() - start_time < 1.0:  # 1 second timeout
         try:
-            readable, _, _ = select.select([rfile2.fileno()], [], [], 0.1)
+            readable, _, _ = select.select([rfile2.fileno()], [], [], max(0, start_time + 1.0 - time.time()))
             if readable:
-                header = rfile2.read(6)  # Changed from 9 to 6
+                header = rfile2.read(protocol.HEADER.size)
                 if header:
-                    packet_type, seq_num, checksum, payload_len = struct.unpack('!BBHH', header)  # Changed from BBLHB to BBHH
+                    packet_type, seq_num, checksum, payload_len = protocol.HEADER.unpack(header)
                     # Read the payload
                     payload = rfile2.read(payload_len)
                     if packet_type == protocol.PACKET_TYPES['SYSTEM_MESSAGE']:
@@ -243,9 +230,6 @@ def test_retransmission():
             logger.error(f"Error in retransmission test: {str(e)}")
             continue
     
-    # Wait for ACK handler to complete
-    ack_thread.join(timeout=0.1)
-    
     # The test should pass if we got a retransmission and the original send failed
     # (which it should since we're not sending ACKs)
     test_result = retransmitted and not success
@@ -256,43 +240,35 @@ def test_ack():
     """Test basic acknowledgment functionality."""
     logger.info("Test commencing: ACK Functionality")
     # Create test socket pair
-    s1, s2 = socket.socketpair()
-    rfile1 = s1.makefile('rb')
-    wfile1 = s1.makefile('wb')
-    rfile2 = s2.makefile('rb')
-    wfile2 = s2.makefile('wb')
+    rfile1, wfile1, rfile2, wfile2 = _socket_pair()
     
     # Test parameters
     num_packets = 100
     ack_received = 0
     
+    # Every iteration sends the same packet, so pack it once
+    data = protocol.Packet(protocol.PACKET_TYPES['SYSTEM_MESSAGE'], 1, b'test').pack()
+    
     for _ in range(num_packets):
-        # Create and send packet
-        packet = protocol.Packet(protocol.PACKET_TYPES['SYSTEM_MESSAGE'], 1, b'test')
-        data = packet.pack()
-        
         # Send packet
         wfile1.write(data)
-        wfile1.flush()
         
         # Read packet and send ACK
         try:
-            header = rfile2.read(6)  # Changed from 9 to 6
+            header = rfile2.read(protocol.HEADER.size)
             if header:
                 # Send ACK
-                packet_type, seq_num, checksum, payload_len = struct.unpack('!BBHH', header)  # Changed from BBLHB to BBHH
-                ack_packet = protocol.Packet(protocol.PACKET_TYPES['ACK'], seq_num, b'')
-                wfile2.write(ack_packet.pack())
-                wfile2.flush()
+                packet_type, seq_num, checksum, payload_len = protocol.HEADER.unpack(header)
+                protocol.send_ack(wfile2, seq_num)
                 
                 # Wait for ACK
                 start_time = time.time()
                 while time.time() - start_time < 1.0:  # 1 second timeout
-                    readable, _, _ = select.select([rfile1.fileno()], [], [], 0.1)
+                    readable, _, _ = select.select([rfile1.fileno()], [], [], max(0, start_time + 1.0 - time.time()))
                     if readable:
-                        ack_header = rfile1.read(6)  # Changed from 9 to 6
+                        ack_header = rfile1.read(protocol.HEADER.size)
                         if ack_header:
-                            ack_type, ack_seq, _, _ = struct.unpack('!BBHH', ack_header)  # Changed from BBLHB to BBHH
+                            ack_type, ack_seq, _, _ = protocol.HEADER.unpack(ack_header)
                             if ack_type == protocol.PACKET_TYPES['ACK'] and ack_seq == seq_num:
                                 ack_received += 1
                                 break
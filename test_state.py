@@ -0,0 +1,28 @@
+import state
+
+def test_reconnect_during_post_game():
+    """Test that a player reconnecting after the game has ended doesn't block the next countdown.
+    accept_connection() only resumes a game with SETUP -> IN_GAME, so POST_GAME must survive it."""
+    state.set_state(state.ServerState.POST_GAME)
+    try:
+        # The reconnection path's transition must not apply outside SETUP
+        assert not state.transition(state.ServerState.SETUP, state.ServerState.IN_GAME)
+        assert state.server_state is state.ServerState.POST_GAME
+        # The end of the game can still hand off to the next countdown
+        assert state.transition(state.ServerState.POST_GAME, state.ServerState.COUNTDOWN)
+    finally:
+        state.set_state(state.ServerState.IDLE)
+
+def test_reconnect_during_setup():
+    """Test that a player reconnecting during ship placement moves the server to IN_GAME."""
+    state.set_state(state.ServerState.SETUP)
+    try:
+        assert state.transition(state.ServerState.SETUP, state.ServerState.IN_GAME)
+        assert state.server_state is state.ServerState.IN_GAME
+    finally:
+        state.set_state(state.ServerState.IDLE)
+
+if __name__ == "__main__":
+    test_reconnect_during_post_game()
+    test_reconnect_during_setup()
+    print("SUCCESS: state tests passed")